@@ -1,71 +1,102 @@
 import numpy as np
 import nibabel as nib
-from scipy.ndimage import gaussian_filter
+from scipy.ndimage import convolve1d
 from skimage.transform import rescale
 from pathlib import Path
+from utils import get_nifti_data, gaussian_kernel1d
 
-def load_nifti(file_path):
-    """
-    Load a NIfTI file and return its data and affine.
-    """
-    img = nib.load(file_path)
-    return img.get_fdata(), img.affine
-
-def save_nifti(data, affine, output_path):
+def save_nifti(data, affine, output_path, dtype=None):
     """
     Save a 3D NumPy array as a NIfTI file.
+    If an integer `dtype` is given, the data is rounded and clipped to that
+    dtype before saving, so the stored values are the values themselves
+    (no scale slope or intercept).
     """
+    if dtype is not None and np.issubdtype(dtype, np.integer):
+        info = np.iinfo(dtype)
+        data = np.clip(np.rint(data), info.min, info.max).astype(dtype)
     img = nib.Nifti1Image(data, affine)
     nib.save(img, output_path)
 
 def add_gaussian_noise(data, mean=0, std_dev=0.05):
     """
     Add Gaussian noise to the 3D image data.
+    The noise is drawn, scaled and added in a single float32 buffer,
+    which is returned as the noisy volume.
     """
     max_pixel = data.max()
     lamda= .5
-    noise = np.random.normal(mean, std_dev, data.shape)
-    return data + max_pixel * noise * lamda
+    scale = max_pixel * lamda
+    noisy_data = np.random.default_rng().standard_normal(data.shape, dtype=np.float32)
+    noisy_data *= scale * std_dev
+    if mean:
+        noisy_data += scale * mean
+    noisy_data += data
+    return noisy_data
 
-def blur_in_direction(data, sigma, axis):
+def blur_in_direction(data, sigma, axis, truncate=3.0):
     """
-    Apply Gaussian blurring in a specific direction.
+    Apply Gaussian blurring in a specific direction (or tuple of directions).
+    The blur is applied as separable 1D passes with a cached kernel, all
+    after the first running in place on the output buffer.
     """
-    blurred_data = np.copy(data)
-    gaussian_filter(data, sigma=sigma, output=blurred_data, mode='nearest', axes=axis)
+    if sigma <= 0:
+        return data.copy()
+    kernel = gaussian_kernel1d(sigma, truncate)
+    blurred_data = np.empty_like(data)
+    source = data
+    for ax in np.atleast_1d(axis):
+        convolve1d(source, kernel, axis=int(ax), output=blurred_data, mode='nearest')
+        source = blurred_data
     return blurred_data
 
 def downsample(data, scale=(0.5, 1, 1)):
     """
     Downsample the 3D image by a specified scale factor.
     Scale factor should be a tuple for (depth, height, width).
+    Scales that are reciprocals of integers (e.g. 0.5) are computed as a
+    block mean over each k-voxel group; other scales fall back to rescale.
     """
-    return rescale(data, scale, anti_aliasing=True, preserve_range=True)
+    factors = [round(1 / s) for s in scale]
+    if not all(k >= 1 and np.isclose(k * s, 1) for k, s in zip(factors, scale)):
+        return rescale(data, scale, anti_aliasing=True, preserve_range=True)
+
+    # Drop trailing voxels that do not fill a whole block, then average each block
+    trimmed = data[tuple(slice(0, (n // k) * k) for n, k in zip(data.shape, factors))]
+    blocks = trimmed.reshape([d for n, k in zip(trimmed.shape, factors) for d in (n // k, k)])
+    return blocks.mean(axis=tuple(range(1, blocks.ndim, 2)))
 
 def augment_ct_volume(ct_file, output_dir):
     """
     Perform multiple augmentations on a 3D CT volume and save each one.
     """
-    data, affine = load_nifti(ct_file)
+    img = nib.load(ct_file)
+    data, affine = get_nifti_data(img), img.affine
+    # CT volumes are usually stored unscaled as int16 HU; write the augmentations back in
+    # the same integer dtype rather than float32 to halve the bytes compressed and written
+    ct_dtype = img.get_data_dtype()
+    is_unscaled = img.dataobj.slope == 1 and img.dataobj.inter == 0
+    output_dtype = ct_dtype if np.issubdtype(ct_dtype, np.integer) and is_unscaled else None
     ct_name = Path(ct_file).stem
     output_dir = Path(output_dir) / f"{ct_name}_augmented"
     output_dir.mkdir(parents=True, exist_ok=True)
 
     # Augmentation 1: Add Gaussian Noise
     noisy_data = add_gaussian_noise(data)
-    save_nifti(noisy_data, affine, output_dir / f"{ct_name}_noisy.nii.gz")
+    save_nifti(noisy_data, affine, output_dir / f"{ct_name}_noisy.nii.gz", dtype=output_dtype)
 
     # Augmentation 2: Blur in SI direction (axis 0)
     si_blurred_data = blur_in_direction(data, sigma=2, axis=1)
-    save_nifti(si_blurred_data, affine, output_dir / f"{ct_name}_blurred_SI.nii.gz")
+    save_nifti(si_blurred_data, affine, output_dir / f"{ct_name}_blurred_SI.nii.gz", dtype=output_dtype)
 
-    # Augmentation 3: Blur in other directions (axis 1 and 2)
-    other_blurred_data = gaussian_filter(data, sigma=2, mode='nearest')  # Blur in AP direction
-    save_nifti(other_blurred_data, affine, output_dir / f"{ct_name}_blurred_all.nii.gz")
+    # Augmentation 3: Blur in all directions; the Gaussian is separable, so reuse the
+    # axis-1 pass from augmentation 2 and only blur the remaining axes (0 and 2)
+    other_blurred_data = blur_in_direction(si_blurred_data, sigma=2, axis=(0, 2))
+    save_nifti(other_blurred_data, affine, output_dir / f"{ct_name}_blurred_all.nii.gz", dtype=output_dtype)
 
     # Augmentation 4: Downsample to simulate fewer detectors
     downsampled_data = downsample(data, scale=(0.5, 1, 1))
-    save_nifti(downsampled_data, affine, output_dir / f"{ct_name}_downsampled.nii.gz")
+    save_nifti(downsampled_data, affine, output_dir / f"{ct_name}_downsampled.nii.gz", dtype=output_dtype)
 
     print(f"Augmented data saved in {output_dir}")
 
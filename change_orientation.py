@@ -1,21 +1,20 @@
+import os
 import nibabel as nib
 import numpy as np
 from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+from utils import load_nifti_file
 
-def load_nifti_file(file_path):
-    """
-    Load a NIfTI file and return the image data and affine matrix.
-    
-    Args:
-        file_path (str): Path to the .nii file.
-        
-    Returns:
-        tuple: A tuple containing the image data as a NumPy array and the affine matrix.
-    """
-    img = nib.load(file_path)
-    data = img.get_fdata()
-    affine = img.affine
-    return data, affine
+# Flip name -> axes reversed for that flip
+FLIPS = {
+    "flip_x": (0,),
+    "flip_y": (1,),
+    "flip_z": (2,),
+    "flip_xy": (0, 1),
+    "flip_xz": (0, 2),
+    "flip_yz": (1, 2),
+    "flip_xyz": (0, 1, 2),
+}
 
 def flip_and_save_nifti(data, affine, output_directory, file_name_prefix):
     """
@@ -30,23 +29,19 @@ def flip_and_save_nifti(data, affine, output_directory, file_name_prefix):
     output_dir = Path(output_directory)
     output_dir.mkdir(parents=True, exist_ok=True)
 
-    # Define flipping operations
-    flip_operations = {
-        "flip_x": np.flip(data, axis=0),
-        "flip_y": np.flip(data, axis=1),
-        "flip_z": np.flip(data, axis=2),
-        "flip_xy": np.flip(np.flip(data, axis=0), axis=1),
-        "flip_xz": np.flip(np.flip(data, axis=0), axis=2),
-        "flip_yz": np.flip(np.flip(data, axis=1), axis=2),
-        "flip_xyz": np.flip(np.flip(np.flip(data, axis=0), axis=1), axis=2),
-    }
-
-    # Save each flipped version as a new NIfTI file
-    for flip_name, flipped_data in flip_operations.items():
+    def save_flip(flip_name, axes):
+        # np.flip returns a view; nibabel writes it out slice by slice without copying the volume
+        flipped_data = np.flip(data, axis=axes)
         output_file = output_dir / f"{file_name_prefix}_{flip_name}.nii.gz"
         flipped_img = nib.Nifti1Image(flipped_data, affine)
         nib.save(flipped_img, str(output_file))
-        print(f"Saved flipped image: {output_file}")
+        return output_file
+
+    # Save each flipped version as a new NIfTI file; gzip releases the GIL, so the writes run in parallel
+    with ThreadPoolExecutor(max_workers=min(len(FLIPS), os.cpu_count() or 1)) as executor:
+        futures = [executor.submit(save_flip, flip_name, axes) for flip_name, axes in FLIPS.items()]
+        for future in futures:
+            print(f"Saved flipped image: {future.result()}")
 
 if __name__ == "__main__":
     # Path to the original mask file
@@ -3,26 +3,14 @@
 import numpy as np
 import nibabel as nib
 import matplotlib.pyplot as plt
-from scipy.ndimage import gaussian_filter
+from scipy.ndimage import convolve1d
+from scipy.signal import fftconvolve
 from totalsegmentator.python_api import totalsegmentator
 from pathlib import Path
-from segmentation import save_combined_segmentation
+from utils import load_nifti_file, save_combined_nifti, gaussian_kernel1d
 
 ### Loading and Processing Functions ###
 
-def load_nifti(file_path):
-    """
-    Load a NIfTI file and return the image data.
-    
-    Args:
-        file_path (str): Path to the .nii or .nii.gz file.
-        
-    Returns:
-        np.ndarray: Image data as a NumPy array.
-    """
-    img = nib.load(file_path)
-    return img.get_fdata()
-
 def binarize_data(data, threshold=0.5):
     """
     Binarize the input data at the specified threshold.
@@ -32,9 +20,9 @@ def binarize_data(data, threshold=0.5):
         threshold (float): Threshold value for binarization.
         
     Returns:
-        np.ndarray: Binarized data.
+        np.ndarray: Binarized data as a boolean mask.
     """
-    return (data > threshold).astype(np.float32)
+    return data > threshold
 
 ### Dice Score Calculation ###
 
@@ -42,6 +30,10 @@ def dice_score(y_true, y_pred):
     """
     Calculate Dice score between two binary masks.
     
+    Nonzero voxels count as foreground, so label volumes can be passed
+    directly without thresholding; the sums are taken with np.count_nonzero
+    rather than float multiplies.
+    
     Args:
         y_true (np.ndarray): Ground truth binary mask.
         y_pred (np.ndarray): Predicted binary mask.
@@ -49,58 +41,113 @@ def dice_score(y_true, y_pred):
     Returns:
         float: Dice score.
     """
-    if y_true.sum() == 0 and y_pred.sum() == 0:
+    true_sum = np.count_nonzero(y_true)
+    pred_sum = np.count_nonzero(y_pred)
+    if true_sum == 0 and pred_sum == 0:
         return 1.0
-    intersect = np.sum(y_true * y_pred)
-    denominator = np.sum(y_true) + np.sum(y_pred)
+    intersect = np.count_nonzero(np.logical_and(y_true, y_pred))
+    denominator = true_sum + pred_sum
     f1 = (2 * intersect) / (denominator + 1e-6)
     return f1
 
 ### Augmentation and Experimentation Functions ###
 
-def apply_gaussian_blur(data, sigma):
+# Gaussian kernels are truncated at this many standard deviations
+BLUR_TRUNCATE = 3.0
+# Kernels wider than this (in voxels) are applied through FFT convolution
+FFT_KERNEL_WIDTH = 32
+
+def _fft_gaussian_filter1d(data, sigma, axis, truncate=BLUR_TRUNCATE):
+    """
+    Apply a 1D Gaussian blur along one axis using FFT convolution.
+    
+    The input is padded by symmetric reflection, matching the 'reflect'
+    boundary mode of scipy.ndimage.gaussian_filter.
+    
+    Args:
+        data (np.ndarray): 3D image data.
+        sigma (float): Standard deviation for Gaussian kernel.
+        axis (int): Axis along which to blur.
+        truncate (float): Truncate the kernel at this many standard deviations.
+        
+    Returns:
+        np.ndarray: Blurred image data.
+    """
+    kernel = gaussian_kernel1d(sigma, truncate)
+    radius = kernel.size // 2
+    pad_width = [(0, 0)] * data.ndim
+    pad_width[axis] = (radius, radius)
+    kernel_shape = [1] * data.ndim
+    kernel_shape[axis] = kernel.size
+    padded = np.pad(data, pad_width, mode='symmetric')
+    return fftconvolve(padded, kernel.reshape(kernel_shape), mode='valid', axes=axis)
+
+def apply_gaussian_blur(data, sigma, output=None):
     """
     Apply Gaussian blur to a 3D volume.
     
+    Small kernels are applied as one direct 1D convolution per axis with a
+    cached kernel; wide kernels as one FFT convolution per axis.
+    
     Args:
         data (np.ndarray): 3D image data.
         sigma (float): Standard deviation for Gaussian kernel.
+        output (np.ndarray, optional): Preallocated array to write the result into (may be `data` itself).
         
     Returns:
         np.ndarray: Blurred image data.
     """
-    return gaussian_filter(data, sigma=sigma)
-
-def run_totalsegmentator(input_data, output_dir):
+    if output is None:
+        output = np.empty_like(data)
+    if sigma <= 0:
+        np.copyto(output, data)
+    elif 2 * BLUR_TRUNCATE * sigma <= FFT_KERNEL_WIDTH:
+        kernel = gaussian_kernel1d(sigma, BLUR_TRUNCATE)
+        source = data
+        for axis in range(data.ndim):
+            convolve1d(source, kernel, axis=axis, output=output, mode='reflect')
+            source = output
+    else:
+        blurred = data
+        for axis in range(data.ndim):
+            blurred = _fft_gaussian_filter1d(blurred, sigma, axis)
+        np.copyto(output, blurred)
+    return output
+
+def run_totalsegmentator(input_data, affine=np.eye(4)):
     """
     Run TotalSegmentator on the blurred input data.
     
+    The volume is handed to TotalSegmentator as an in-memory NIfTI image and
+    the multilabel segmentation is returned directly, so no temporary input
+    or per-organ output files are written.
+    
     Args:
         input_data (np.ndarray): Blurred 3D input data for segmentation.
-        output_dir (Path): Directory to store segmentation output.
+        affine (np.ndarray): Affine matrix for the input image.
         
     Returns:
-        np.ndarray: Segmented output as a NumPy array.
+        np.ndarray: Segmented output (one label per organ) as a NumPy array.
     """
-    # Save the blurred image temporarily to run TotalSegmentator
-    blurred_path = output_dir / "blurred_input.nii.gz"
-    nib.save(nib.Nifti1Image(input_data, affine=np.eye(4)), str(blurred_path))
+    input_img = nib.Nifti1Image(input_data, affine=affine)
     
     # Run TotalSegmentator on the blurred input
-    totalsegmentator(str(blurred_path), output=str(output_dir), fastest=True)
+    output_img = totalsegmentator(input_img, output=None, ml=True, fastest=True)
     
-
-    data = save_combined_segmentation(output_dir)
-    return data
+    return np.asarray(output_img.dataobj, dtype=np.uint8)
 
 def calculate_dice_vs_blur(gt_path, input_path, output_dir, blur_range=(0, 15), blur_steps=10):
     """
     Calculate Dice score for different levels of Gaussian blur on input data.
     
+    Gaussians compose (G(s1) * G(s2) = G(sqrt(s1^2 + s2^2))), so the levels are
+    visited in ascending order and each one is reached by blurring the previous
+    level in place with the incremental sigma instead of starting from scratch.
+    
     Args:
         gt_path (str): Path to the ground truth NIfTI file.
         input_path (str): Path to the original input NIfTI file.
-        output_dir (str): Directory to save temporary files.
+        output_dir (str): Directory to save the segmentation for each blur level.
         blur_range (tuple): Range of Gaussian blur sigma values to test.
         blur_steps (int): Number of blur levels to test.
         
@@ -108,24 +155,31 @@ def calculate_dice_vs_blur(gt_path, input_path, output_dir, blur_range=(0, 15),
         list: List of blur levels.
         list: List of corresponding Dice scores.
     """
-    gt_data = binarize_data(load_nifti(gt_path))
-    input_data = load_nifti(input_path)
+    gt_data, _ = load_nifti_file(gt_path, dtype=np.uint8)
+    gt_data = binarize_data(gt_data)
+    input_data, _ = load_nifti_file(input_path)
     
-    blur_levels = np.linspace(blur_range[0], blur_range[1], blur_steps)
+    blur_levels = np.sort(np.linspace(blur_range[0], blur_range[1], blur_steps))
     dice_scores = []
     
     output_dir = Path(output_dir)
     output_dir.mkdir(parents=True, exist_ok=True)
 
+    # The input itself is blurred in place, one increment per level
+    blurred_input = input_data
+    previous_sigma = 0.0
+
     for sigma in blur_levels:
-        # Apply Gaussian blur to input data
-        blurred_input = apply_gaussian_blur(input_data, sigma)
+        # Blur the previous level up to the current sigma
+        delta_sigma = np.sqrt(max(sigma ** 2 - previous_sigma ** 2, 0.0))
+        apply_gaussian_blur(blurred_input, delta_sigma, output=blurred_input)
+        previous_sigma = sigma
         
         # Run TotalSegmentator on the blurred input and get the segmented output
-        segmented_output = run_totalsegmentator(blurred_input, output_dir)
-        segmented_output = binarize_data(segmented_output)
+        segmented_output = run_totalsegmentator(blurred_input)
+        save_combined_nifti(segmented_output, np.eye(4), output_dir / f"segmentation_sigma_{sigma:.2f}.nii")
         
-        # Calculate Dice score and append to list
+        # Calculate Dice score and append to list; any nonzero label counts as foreground
         dice = dice_score(gt_data, segmented_output)
         dice_scores.append(dice)
         print(f"Sigma: {sigma:.2f}, Dice Score: {dice:.4f}")
@@ -1,8 +1,26 @@
+import os
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
 from segmentation import run_totalsegmentator, save_combined_segmentation
 from utils import load_config, find_ct_files, create_output_directory
 from pathlib import Path
 from tqdm import tqdm
 
+# Each combine worker holds a full label volume and imports TotalSegmentator (torch),
+# so the pool is kept small rather than one worker per core
+MAX_COMBINE_WORKERS = 4
+
+
+def combine_segmentation_worker(output_path):
+    """
+    Combine and save the segmentations in output_path inside a worker process.
+
+    Only the path is sent back, so the combined volume is not pickled across processes.
+    Progress output is turned off so it does not interleave with the main progress bar.
+    """
+    save_combined_segmentation(output_path, verbose=False)
+    return output_path
+
 
 def main():
     # Load configuration from config.yml
@@ -21,21 +39,31 @@ def main():
     print(f"Found {len(ct_files)} 'ct.nii.gz' files.")
 
     output_paths = []
-    # Step 2: Run segmentation on each file with a progress bar
-    for ct_file in tqdm(ct_files, desc="Processing CT files", unit="file"):
-    
-        # Create the output directory
-        # Convert paths to pathlib.Path objects
-        
-        output_directory = create_output_directory(ct_file, parent_path = None)
-        
-        output_path = run_totalsegmentator(ct_file, output_directory, task)
+    # Step 2: Run segmentation on each file with a progress bar. TotalSegmentator runs
+    # one file at a time (GPU bound), while combining the finished outputs (CPU/IO bound)
+    # is handed to a process pool so it overlaps with the next segmentation.
+    # Workers are spawned rather than forked: by the first submit the parent already holds
+    # torch thread pools and a CUDA context, which are unsafe to fork
+    with ProcessPoolExecutor(
+        max_workers=min(MAX_COMBINE_WORKERS, os.cpu_count() or 1),
+        mp_context=multiprocessing.get_context("spawn"),
+    ) as executor:
+        futures = {}
+        for ct_file in tqdm(ct_files, desc="Processing CT files", unit="file"):
         
-        # Combine the segmentations
-        combined_data = save_combined_segmentation(output_path)
+            # Create the output directory
+            # Convert paths to pathlib.Path objects
+            
+            output_directory = create_output_directory(ct_file, parent_path = None)
+            
+            output_path = run_totalsegmentator(ct_file, output_directory, task)
+            
+            # Combine the segmentations
+            futures[ct_file] = executor.submit(combine_segmentation_worker, output_path)
 
-        output_paths.append(output_path)
-        print(f"Segmentation completed for {ct_file}")
+        for ct_file, future in futures.items():
+            output_paths.append(future.result())
+            print(f"Segmentation completed for {ct_file}")
         
 
 if __name__ == "__main__":
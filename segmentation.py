@@ -1,8 +1,14 @@
 import os
 import numpy as np
+import nibabel as nib
 from pathlib import Path
+from tqdm import tqdm
 from totalsegmentator.python_api import totalsegmentator
-from utils import load_nifti_file, save_combined_nifti, get_timestamp
+from utils import save_combined_nifti, get_timestamp
+
+# Approximate bytes of one uint8 slab handled per file while combining, sized so the
+# combined slab and the current organ slab stay cache resident (32 slices of 512x512)
+COMBINE_SLAB_BYTES = 8 * 1024 * 1024
 
 def run_totalsegmentator(ct_path, output_directory, task = 'total'):
     """
@@ -18,12 +24,17 @@ def run_totalsegmentator(ct_path, output_directory, task = 'total'):
     print(f"TotalSegmentator output saved to: {output_directory}")
     return output_directory
 
-def combine_segmentations(output_directory):
+def combine_segmentations(output_directory, verbose=True):
     """
     Combine multiple segmentation NIfTI files into a single volume, assigning unique class labels to each.
     
+    The volume is combined slab by slab along the last (slowest on disk) axis: every
+    organ file is read lazily one slab at a time and merged into the matching slab of
+    the combined volume, so only a single slab per file is ever decoded into memory.
+    
     Args:
         output_directory (str): Directory where the NIfTI files are located.
+        verbose (bool): Show a progress bar while combining.
         
     Returns:
         np.ndarray: Combined segmentation data as a NumPy array with unique class labels.
@@ -32,28 +43,37 @@ def combine_segmentations(output_directory):
     # Get a list of all .nii files in the output directory
     nii_files = [f for f in os.listdir(output_directory) if f.endswith('.nii.gz')]
     
-    # Load the first image to get the dimensions and affine matrix
-    first_file_path = os.path.join(output_directory, nii_files[0])
-    sample_data, affine = load_nifti_file(first_file_path)
+    # Keep each file open so consecutive slab reads continue decompressing where the last stopped
+    images = [nib.load(os.path.join(output_directory, nii_file), keep_file_open=True) for nii_file in nii_files]
+
+    # Take the dimensions and affine matrix from the first header; no voxel data is decoded
+    affine = images[0].affine
     
     # Create an empty array to hold the combined segmentations (same shape as the first file)
-    combined_data = np.zeros(sample_data.shape, dtype=np.uint8)
-    
-    # Assign unique labels for each organ (starting from 1)
-    for idx, nii_file in enumerate(nii_files, start=1):
-        file_path = os.path.join(output_directory, nii_file)
-        data, _ = load_nifti_file(file_path)
+    combined_data = np.zeros(images[0].shape, dtype=np.uint8)
 
-        # Assume binary segmentation (0 = background, 1 = organ), assign unique label (idx) to the organ
-        combined_data[data > 0] = idx
-        
-        print(f"Combined segmentation for {nii_file} with label {idx}.")
+    slice_bytes = int(np.prod(combined_data.shape[:-1]))
+    slab_depth = max(1, COMBINE_SLAB_BYTES // slice_bytes)
+
+    for z0 in tqdm(range(0, combined_data.shape[-1], slab_depth), desc="Combining segmentations", unit="slab", disable=not verbose):
+        combined_slab = combined_data[..., z0:z0 + slab_depth]
+
+        # Assign unique labels for each organ (starting from 1)
+        for idx, img in enumerate(images, start=1):
+            data = np.asarray(img.dataobj[..., z0:z0 + slab_depth], dtype=np.uint8)
+
+            # Organs absent from this slab produce empty masks; nothing to merge
+            if not data.any():
+                continue
+
+            # Assume binary segmentation (0 = background, 1 = organ), assign unique label (idx) to the organ
+            np.putmask(combined_slab, data != 0, idx)
     
     return combined_data, affine
 
 
-def save_combined_segmentation(output_path):
-    combined_data, affine = combine_segmentations(output_path)
+def save_combined_segmentation(output_path, verbose=True):
+    combined_data, affine = combine_segmentations(output_path, verbose=verbose)
     combined_output_path = Path(output_path) / f"_combined_{get_timestamp()}.nii"
-    save_combined_nifti(combined_data, affine, combined_output_path)
+    save_combined_nifti(combined_data, affine, combined_output_path, verbose=verbose)
     return combined_data
\ No newline at end of file
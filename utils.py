@@ -1,13 +1,42 @@
+import os
+from functools import lru_cache
+import numpy as np
 import nibabel as nib
 import yaml
 from datetime import datetime
-from pathlib import WindowsPath
+from pathlib import Path, WindowsPath
 
 def get_timestamp():
     timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
 
     return timestamp
 
+@lru_cache(maxsize=None)
+def gaussian_kernel1d(sigma, truncate=3.0):
+    """
+    Build a normalized 1D Gaussian kernel with the same support as scipy's.
+    
+    Kernels are cached per (sigma, truncate), so repeated blurs with the same
+    sigma (e.g. one pass per axis) reuse the coefficients.
+    
+    Args:
+        sigma (float): Standard deviation for Gaussian kernel.
+        truncate (float): Truncate the kernel at this many standard deviations.
+        
+    Returns:
+        np.ndarray: Read-only 1D float32 kernel of length 2 * radius + 1
+        (the identity kernel [1.0] when sigma <= 0).
+    """
+    if sigma <= 0:
+        kernel = np.ones(1, dtype=np.float32)
+    else:
+        radius = int(truncate * sigma + 0.5)
+        x = np.arange(-radius, radius + 1)
+        kernel = np.exp(-0.5 * (x / sigma) ** 2)
+        kernel = (kernel / kernel.sum()).astype(np.float32)
+    kernel.flags.writeable = False
+    return kernel
+
 def load_config(config_file):
     """
     Load the configuration file (config.yml).
@@ -22,22 +51,39 @@ def load_config(config_file):
         config = yaml.safe_load(file)
     return config
 
-def load_nifti_file(file_path):
+def get_nifti_data(img, dtype=np.float32):
+    """
+    Read the voxel data of a loaded NIfTI image in the requested dtype.
+    
+    The data is read straight from the array proxy, avoiding the float64
+    promotion done by get_fdata().
+    
+    Args:
+        img (nib.Nifti1Image): Loaded NIfTI image.
+        dtype (np.dtype): Data type of the returned array.
+        
+    Returns:
+        np.ndarray: Image data as a NumPy array.
+    """
+    return np.asarray(img.dataobj, dtype=dtype)
+
+def load_nifti_file(file_path, dtype=np.float32):
     """
     Load a NIfTI file and return the image data and the affine transformation.
     
     Args:
         file_path (str): Path to the .nii file.
+        dtype (np.dtype): Data type of the returned array.
         
     Returns:
         tuple: A tuple containing the image data as a NumPy array and the affine matrix.
     """
     img = nib.load(file_path)
-    data = img.get_fdata()
+    data = get_nifti_data(img, dtype=dtype)
     affine = img.affine
     return data, affine
 
-def save_combined_nifti(combined_data, affine, output_path):
+def save_combined_nifti(combined_data, affine, output_path, verbose=True):
     """
     Save the combined segmentation data as a NIfTI file.
     
@@ -45,15 +91,21 @@ def save_combined_nifti(combined_data, affine, output_path):
         combined_data (np.ndarray): Combined segmentation data as a NumPy array.
         affine (np.ndarray): Affine transformation matrix for the NIfTI file.
         output_path (str): Path to save the combined NIfTI file.
+        verbose (bool): Print the saved path.
     """
     combined_img = nib.Nifti1Image(combined_data, affine)
     nib.save(combined_img, output_path)
-    print(f"Combined NIfTI file saved at {output_path}.")
+    if verbose:
+        print(f"Combined NIfTI file saved at {output_path}.")
 
 def find_ct_files(base_directory):
     """
     Recursively find all 'ct.nii.gz' files in the base directory.
 
+    The tree is walked with os.scandir, matching on the entry name only and
+    skipping 'TotalSegmentator_*' output directories, whose per-organ masks
+    would otherwise be picked up as CT volumes.
+
     Args:
         base_directory (Path): Path to the base directory.
 
@@ -61,9 +113,16 @@ def find_ct_files(base_directory):
         list: List of Paths to each 'ct.nii.gz' file found.
     """
     ct_files = []
-    for ct_file in base_directory.rglob('*nii.gz'):
-        ct_files.append(ct_file)
-    return ct_files
+    stack = [str(base_directory)]
+    while stack:
+        with os.scandir(stack.pop()) as entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    if not entry.name.startswith('TotalSegmentator_'):
+                        stack.append(entry.path)
+                elif entry.name.endswith('nii.gz'):
+                    ct_files.append(Path(entry.path))
+    return sorted(ct_files)
 
 def create_output_directory(ct_file: WindowsPath, parent_path: WindowsPath = None):
     """